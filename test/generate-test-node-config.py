@@ -2,9 +2,18 @@
 
 import subprocess
 import json
+import os
+import sys
 import pprint
 import base64
 import hashlib
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 configname="server.list"
 
@@ -13,6 +22,26 @@ binary="../ton-build/generate-random-id"
 ids=[]
 catchains=[]
 public_overlays=[]
+key_ids={}
+by_endpoint={}
+
+def json_loads(s):
+    if orjson is not None:
+        return orjson.loads(s)
+    return json.loads(s)
+
+def json_dumps(v):
+    if orjson is not None:
+        return orjson.dumps(v).decode("utf-8")
+    return json.dumps(v, separators=(',', ':'))
+
+def json_dump_file(v, name):
+    if orjson is not None:
+        with open(name, 'wb') as outfile:
+            outfile.write(orjson.dumps(v, option=orjson.OPT_INDENT_2))
+    else:
+        with open(name, 'w') as outfile:
+            json.dump(v, outfile, indent=2)
 
 def ip2str(ip):
     b = ip.split(".")
@@ -22,68 +51,93 @@ def ip2str(ip):
     else:
         return str(v)
 
+@functools.lru_cache(maxsize=None)
+def catchain_tag(name):
+    return base64.b64encode(hashlib.sha256(name.encode("utf-8")).digest()).decode("utf-8")
+
 def get_addr_list(node):
-    return '{"@type":"adnl.addressList","version":0,"addrs":[{"@type":"adnl.address.udp","ip":'+ \
-        ip2str(node['ip'])+',"port":'+node['port']+'}]}'
+    return json_dumps({'@type':'adnl.addressList','version':0,'addrs':[{'@type':'adnl.address.udp', \
+        'ip':node['ip_num'],'port':int(node['port'])}]})
 
 def generate_dht_node(node):
     global binary
     addr_list = get_addr_list(node)
     r = subprocess.run([binary, '-k', node['spk'], '-a', addr_list, '-m', 'dht'], capture_output=True) 
-    s = r.stdout.decode("utf-8").split("\n")
-    return json.loads(s[0])
+    s = r.stdout.split(b"\n")
+    return json_loads(s[0])
 
-def add_id(s):
+def generate_id(pk):
     global binary
+    if pk == None:
+        r = subprocess.run([binary, '-m', 'id'], capture_output=True)
+        s = r.stdout.split(b"\n")
+        return json_loads(s[0]), json_loads(s[1]), json_loads(s[2])
+    r = subprocess.run([binary, '-k', pk, '-m', 'id'], capture_output=True)
+    s = r.stdout.split(b"\n")
+    return json_loads(pk), json_loads(s[1]), json_loads(s[2])
+
+def parse_options(options):
+    opts = {'dht' : False, 'dhtstatic' : False, 'validator' : False, 'liteserver' : False, 'catchains' : []}
+    for opt in options:
+        if opt.startswith('+catchain'):
+            if not opt[9:] in opts['catchains']:
+                opts['catchains'].append(opt[9:])
+        elif opt.startswith('+liteserver'):
+            opts['liteserver'] = True
+        elif opt in ('+dht', '+dhtstatic', '+validator'):
+            opts[opt[1:]] = True
+    return opts
+
+# keys are generated concurrently, results are filled in by readconfig
+def add_fixed_id(ip, port, pk, options, executor):
+    global ids
+    global key_ids
 
-    if len(s) < 1 or s[0] == '#':
-        return
-
-    t = s.split(" ")
-    assert(len(t) >= 3)
-    ip = t[0]
-    port = t[1]
-    pk = t[2]
-    options = t[3:]
-    pub = '-'
-    short = '-'
-    rand = None 
-    spk = pk
-
-    if (pk[0] != '-'):
-        r = subprocess.run([binary, '-k', pk, '-m', 'id'], capture_output=True) 
-        s = r.stdout.decode("utf-8").split("\n")
-        pk = json.loads(pk)
-        pub = json.loads(s[1])
-        short = json.loads(s[2])
-        if '+dhtstatic' in options:
-            if not '+dht' in options:
-                options.append('+dht')
-    else:
-        if '+dhtstatic' in options:
-            print("cannot use dht static on random node")
-            sys.exit(2)
-        if any(opt.startswith('+catchain') for opt in options):
-            print("cannot use catchain on random node")
-            sys.exit(2)
-        rand=int(pk[1:])
+    opts = parse_options(options)
+    if opts['dhtstatic']:
+        opts['dht'] = True
+
+    if not pk in key_ids:
+        key_ids[pk] = executor.submit(generate_id, pk)
+    ids.append({'ip' : ip, 'port' : port, 'opts' : opts, 'spk' : pk, 'rand' : None, 'keys' : key_ids[pk]})
 
+def add_random_ids(ip, port, spk, options, executor):
     global ids
-    if rand == None:
-        ids.append({'ip' : ip, 'port' : port, 'options' : options, 'pk' : pk, 'spk' : spk, 'pub' : pub, 'short' : short, 'rand' : rand})
-    else:
-        for x in range(0, rand):
-            r = subprocess.run([binary, '-m', 'id'], capture_output=True) 
-            s = r.stdout.decode("utf-8").split("\n")
-            pk = json.loads(s[0])
-            pub = json.loads(s[1])
-            short = json.loads(s[2])
-            ids.append({'ip' : ip, 'port' : port, 'options' : options, 'pk' : pk, 'spk' : spk, 'pub' : pub, 'short' : short, 'rand' : None})
+
+    opts = parse_options(options)
+    if opts['dhtstatic']:
+        print("cannot use dht static on random node")
+        sys.exit(2)
+    if len(opts['catchains']) > 0:
+        print("cannot use catchain on random node")
+        sys.exit(2)
+
+    for x in range(0, int(spk[1:])):
+        ids.append({'ip' : ip, 'port' : port, 'opts' : opts, 'spk' : spk, 'rand' : None, \
+            'keys' : executor.submit(generate_id, None)})
 
 def readconfig(name):
+    global ids
     with open(name) as f: 
-        for s in f.readlines():
-            add_id(s.strip())
+        lines = [s for s in map(str.strip, f.read().splitlines()) if len(s) > 0 and s[0] != '#']
+
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+        for s in lines:
+            t = s.split(" ")
+            assert(len(t) >= 3)
+            if t[2][0] != '-':
+                add_fixed_id(t[0], t[1], t[2], t[3:], executor)
+            else:
+                add_random_ids(t[0], t[1], t[2], t[3:], executor)
+    for node in ids:
+        node['pk'], node['pub'], node['short'] = node.pop('keys').result()
+
+def index_ids():
+    global ids
+    global by_endpoint
+    for node in ids:
+        node['ip_num'] = int(ip2str(node['ip']))
+        by_endpoint.setdefault((node['ip'], node['port']), []).append(node)
 
 def generate_global_config():
     global ids
@@ -92,42 +146,32 @@ def generate_global_config():
 
     dht={'@type':'dht.config.global','k':6,'a':3}
 
+    dht_static_nodes = [node for node in ids if node['opts']['dhtstatic']]
     dht_nodes=[]
-    for node in ids:
-        if '+dhtstatic' in node['options']:
-            dht_nodes.append(generate_dht_node(node))
+    if len(dht_static_nodes) > 0:
+        with ThreadPoolExecutor(max_workers=min(32, len(dht_static_nodes))) as executor:
+            dht_nodes = list(executor.map(generate_dht_node, dht_static_nodes))
 
     dht['static_nodes'] = {'@type':'dht.nodes','nodes':dht_nodes} 
 
     config['dht'] = dht
 
-    catchains = []
-    for x in ids:
-        for y in x['options']:
-            if y.startswith('+catchain'):
-                assert(x['rand'] == None)
-                name=y[9:]
-                if not name in catchains:
-                    catchains.append(name)
+    catchains={}
+    liteservers=[]
+    for node in ids:
+        for name in node['opts']['catchains']:
+            assert(node['rand'] == None)
+            catchains.setdefault(name, []).append(node['pub'])
+        if node['opts']['liteserver']:
+            assert(node['rand'] == None)
+            liteservers.append({'@type':'liteservers.config.global','ip':node['ip_num'], 'port':4924,'id':node['pub']})
 
     cc=[]
-    for name in catchains: 
-        catchain={'@type':'catchain.config.global','tag':base64.b64encode(hashlib.sha256(name.encode("utf-8")).digest()).decode("utf-8")}
-        catchain_nodes=[]
-        for node in ids:
-            if ('+catchain'+name) in node['options']:
-                catchain_nodes.append(node['pub'])
+    for name, catchain_nodes in catchains.items():
+        catchain={'@type':'catchain.config.global','tag':catchain_tag(name)}
         catchain['nodes'] = catchain_nodes 
         cc.append(catchain)
     config['catchains'] = cc
-    
-    liteservers=[]
-    for node in ids:
-        for opt in node['options']:
-            if opt.startswith('+liteserver'):
-                assert(node['rand'] == None)
-                name=opt[9:]
-                liteservers.append({'@type':'liteservers.config.global','ip':int(ip2str(node['ip'])), 'port':4924,'id':node['pub']})
     config['liteservers'] = liteservers
 
     validators = {"@type": "validator.config.global", "zero_state": {
@@ -140,30 +184,25 @@ def generate_global_config():
 
     config['validator'] = validators
 
-    with open('ton-global.config.json', 'w') as outfile:
-        json.dump(config, outfile, indent=2)
+    json_dump_file(config, 'ton-global.config.json')
 
 def generate_local_config(ip,port):
-    global ids
+    global by_endpoint
     config = {'@type' : 'config.local'}
+    endpoint_nodes = by_endpoint[(ip, port)]
 
-    ports=[]
-    for node in ids:
-        if node['ip'] == ip and node['port'] == port:
-            ports.append(int(node['port']))
-    ports = sorted(set(ports))
-    config['udp_ports'] = ports
+    config['udp_ports'] = [int(port)]
 
     ids_config=[]
-    for node in ids:
-        if node['rand'] == None and node['ip'] == ip and node['port'] == port:
+    for node in endpoint_nodes:
+        if node['rand'] == None:
             ids_config.append({'@type':'id.config.local','id':node['pk']})
     config['local_ids'] = ids_config
 
 
     dht_config=[]
-    for node in ids:
-        if node['ip'] == ip and node['port'] == port and ('+dht' in node['options']):
+    for node in endpoint_nodes:
+        if node['opts']['dht']:
             if node['rand'] == None:
                 dht_config.append({'@type':'dht.config.local', 'id':node['short']})
             else:
@@ -172,36 +211,30 @@ def generate_local_config(ip,port):
     config['dht'] = dht_config
     
     liteservers=[]
-    for node in ids:
-        for opt in node['options']:
-            if opt.startswith('+liteserver') and node['ip'] == ip and node['port'] == port:
-                assert(node['rand'] == None)
-                name=opt[9:]
-                liteservers.append({'@type':'liteserver.config.local','port':4924,'id':node['pk']})
+    for node in endpoint_nodes:
+        if node['opts']['liteserver']:
+            assert(node['rand'] == None)
+            liteservers.append({'@type':'liteserver.config.local','port':4924,'id':node['pk']})
     config['liteservers'] = liteservers
 
     validators=[]
-    for node in ids:
-        for opt in node['options']:
-            if opt == '+validator' and node['ip'] == ip and node['port'] == port:
-                assert(node['rand'] == None)
-                validators.append({'@type':'validator.config.local', 'id':node['short']})
+    for node in endpoint_nodes:
+        if node['opts']['validator']:
+            assert(node['rand'] == None)
+            validators.append({'@type':'validator.config.local', 'id':node['short']})
     config['validators'] = validators
 
     controlserver = {'@type':'control.config.local', 'priv':{"@type":"pk.ed25519","key":"jRbqvPhSr3/xylof9zQyeqbplvWPSIGiHSft3ovKVc4="}, \
             'pub':'Fv8DAtv6nqnrHIPpmv4LGIw0D9cMoF40JXQdM2WVMQM=', 'port':(int(port) + 1000)}
     config['control'] = [controlserver]
 
-    with open('ton-local.' + ip + '.' + port + '.config.json', 'w') as outfile:
-        json.dump(config, outfile, indent=2)
+    json_dump_file(config, 'ton-local.' + ip + '.' + port + '.config.json')
 
 
 
 readconfig(configname)
+index_ids()
 generate_global_config()
 
-ips=["" + node['ip'] + ":" + node['port'] for node in ids]
-ips=set(ips)
-for ip in ips:
-    b = ip.split(":")
-    generate_local_config(b[0], b[1])
+for ip, port in by_endpoint:
+    generate_local_config(ip, port)